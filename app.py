@@ -1,4 +1,10 @@
-from fastapi import FastAPI, Depends, HTTPException, Response, Query
+import asyncio
+import hashlib
+from contextlib import asynccontextmanager
+from typing import Literal
+
+import orjson
+from fastapi import FastAPI, Depends, HTTPException, Request, Response, Query
 from fastapi.responses import FileResponse, RedirectResponse
 from fastapi.staticfiles import StaticFiles
 from pathlib import Path
@@ -14,12 +20,39 @@ load_dotenv()
 
 BASE_DIR = Path(__file__).resolve().parent
 
-app = FastAPI()
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    await movie_service.init_db()
+    # Parse the CSV catalog and open the recommender up front, off the event loop
+    await asyncio.to_thread(movie_service.load_csv_movies)
+    await asyncio.to_thread(movie_service.load_recommender)
+    yield
+    await movie_service.close_db()
+
+
+app = FastAPI(lifespan=lifespan)
 
 app.mount("/styles", StaticFiles(directory=BASE_DIR / "styles"), name="styles")
 app.mount("/scripts", StaticFiles(directory=BASE_DIR / "scripts"), name="scripts")
 
 
+def cached_json(request: Request, payload) -> Response:
+    """JSON response with an ETag; answers 304 when the client's copy is current.
+
+    Payloads carry per-user fields (is_liked), so caches must stay private and
+    revalidate before reuse.
+    """
+    body = orjson.dumps(payload)
+    etag = f'"{hashlib.blake2b(body, digest_size=8).hexdigest()}"'
+    headers = {"ETag": etag, "Cache-Control": "private, no-cache"}
+
+    if_none_match = request.headers.get("if-none-match", "")
+    if etag in (tag.strip() for tag in if_none_match.split(",")):
+        return Response(status_code=304, headers=headers)
+    return Response(content=body, media_type="application/json", headers=headers)
+
+
 @app.get("/")
 def home():
     return RedirectResponse(url="/login")
@@ -31,19 +64,14 @@ def login_page():
 
 
 @app.post("/login/details")
-def login_details(details: login_pydantic, response: Response):
-    db = movie_service.read_db()
-    user_details = None
-    
-    for user in db["users"]:
-        if user["username"] == details.username:
-            user_details = user
-            break
+async def login_details(details: login_pydantic, response: Response):
+    user_details = movie_service.get_user(details.username)
 
     if not user_details:
         raise HTTPException(status_code=400, detail="User not found")
     
-    if not verify_password(details.password, user_details["password"]):
+    # bcrypt is deliberately slow; keep it off the event loop
+    if not await asyncio.to_thread(verify_password, details.password, user_details["password"]):
         raise HTTPException(status_code=400, detail="Incorrect password")
     
     access_token = create_access_token(data={"sub": details.username, "email": user_details["email"]})
@@ -69,18 +97,22 @@ def register():
     return FileResponse(BASE_DIR / "templates" / "register.html", media_type="text/html")
 
 
+def _check_new_user(details: register_pydantic):
+    if movie_service.get_user(details.username):
+        raise HTTPException(status_code=400, detail="Username already exists")
+    if movie_service.get_user_by_email(details.email):
+        raise HTTPException(status_code=400, detail="Email already registered")
+
+
 @app.post("/register/details")
 async def register_details(details: register_pydantic):
-    db = movie_service.read_db()
-    for user in db["users"]:
-        if user["username"] == details.username:
-            raise HTTPException(status_code=400, detail="Username already exists")
-        if user["email"] == details.email:
-            raise HTTPException(status_code=400, detail="Email already registered")
+    _check_new_user(details)
     
-    hashed_password = hash_password(details.password)
+    hashed_password = await asyncio.to_thread(hash_password, details.password)
     
-    db["users"].append({
+    # Re-check after the await: no other request can run between here and the append
+    _check_new_user(details)
+    movie_service.add_user({
         "username": details.username,
         "email": details.email,
         "password": hashed_password,
@@ -88,7 +120,6 @@ async def register_details(details: register_pydantic):
         "viewed_movies": [],
         "search_history": []
     })
-    movie_service.write_db(db)
 
     return {"message": "Registration successful", "username": details.username}
 
@@ -107,9 +138,10 @@ def movie_detail_page(movie_id: int, token_data: dict = Depends(auth_middleware)
 
 @app.get("/api/movies")
 async def get_movies(
+    request: Request,
     limit: int = Query(20, ge=1, le=100),
     offset: int = Query(0, ge=0),
-    category: str = Query("popular", regex="^(popular|top_rated|upcoming)$"),
+    category: Literal["popular", "top_rated", "upcoming"] = Query("popular"),
     token_data: dict = Depends(auth_middleware)
 ):
     """Get paginated list of movies (from local CSV)"""
@@ -120,35 +152,22 @@ async def get_movies(
     total = data["total_results"]
     
     # Add user's liked status to each movie
-    username = token_data.get("sub")
-    db = movie_service.read_db()
-    user = next((u for u in db["users"] if u["username"] == username), None)
-    liked_movie_ids = user.get("liked_movies", []) if user else []
-    
+    liked = movie_service.get_liked_ids(token_data.get("sub"))
     for movie in movies:
-        movie["is_liked"] = movie["id"] in liked_movie_ids
+        movie["is_liked"] = movie["id"] in liked
     
-    return {"movies": movies, "total": total}
+    return cached_json(request, {"movies": movies, "total": total})
 
 
 @app.get("/api/movies/{movie_id}")
-async def get_movie(movie_id: int, token_data: dict = Depends(auth_middleware)):
+async def get_movie(movie_id: int, request: Request, token_data: dict = Depends(auth_middleware)):
     """Get specific movie details"""
-    movie = movie_service.get_movie_by_id(movie_id)
+    # Tracks the view (for ML) and adds the user's liked status
+    movie = await movie_service.get_movie_with_context(token_data.get("sub"), movie_id)
     if not movie:
         raise HTTPException(status_code=404, detail="Movie not found")
     
-    # Track view for ML
-    username = token_data.get("sub")
-    movie_service.track_movie_view(username, movie_id)
-    
-    # Add user's liked status
-    db = movie_service.read_db()
-    user = next((u for u in db["users"] if u["username"] == username), None)
-    liked_movie_ids = user.get("liked_movies", []) if user else []
-    movie["is_liked"] = movie_id in liked_movie_ids
-    
-    return movie
+    return cached_json(request, movie)
 
 
 @app.post("/api/movies/{movie_id}/like")
@@ -164,10 +183,10 @@ async def toggle_like(movie_id: int, token_data: dict = Depends(auth_middleware)
 
 
 @app.get("/api/movies/{movie_id}/comments")
-async def get_comments(movie_id: int, token_data: dict = Depends(auth_middleware)):
+async def get_comments(movie_id: int, request: Request, token_data: dict = Depends(auth_middleware)):
     """Get all comments for a movie"""
     comments = movie_service.get_movie_comments(movie_id)
-    return {"comments": comments}
+    return cached_json(request, {"comments": comments})
 
 
 @app.post("/api/movies/{movie_id}/comments")
@@ -196,18 +215,7 @@ async def search_movies(
     """Search movies by title, overview, or genre (local CSV)"""
     username = token_data.get("sub")
 
-    movie_service.track_search(username, q)
-    all_results = movie_service.search_movies(q)
-    recommendations = movie_service.get_similar_movies(q)
-    db = movie_service.read_db()
-    user = next((u for u in db["users"] if u["username"] == username), None)
-    liked_movie_ids = user.get("liked_movies", []) if user else []
-    
-    for movie in all_results:
-        movie["is_liked"] = movie.get("id") in liked_movie_ids
-        
-    for movie in recommendations:
-        movie["is_liked"] = movie.get("id") in liked_movie_ids
+    all_results, recommendations = await movie_service.search_with_context(username, q)
     
     return {
         "movies": all_results, 
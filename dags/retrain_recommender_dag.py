@@ -3,6 +3,7 @@ from pathlib import Path
 import pickle
 
 import numpy as np
+from scipy import sparse
 from airflow import DAG
 from airflow.operators.bash import BashOperator
 from airflow.operators.python import PythonOperator
@@ -10,32 +11,21 @@ from airflow.operators.python import PythonOperator
 
 BASE_DIR = Path(__file__).resolve().parents[1]
 MOVIES_PKL = BASE_DIR / "model_data" / "movies.pkl"
-SIMILARITY_PKL = BASE_DIR / "model_data" / "similarity.pkl"
+SIMILARITY_NPZ = BASE_DIR / "model_data" / "similarity.npz"
 
 
 def evaluate_similarity() -> None:
     with open(MOVIES_PKL, "rb") as f:
         movies = pickle.load(f)
-    with open(SIMILARITY_PKL, "rb") as f:
-        similarity = pickle.load(f)
-
-    if not hasattr(similarity, "shape"):
-        raise ValueError("Similarity matrix is not a numpy array.")
-
-    n_items = similarity.shape[0]
-    top_k = min(10, n_items - 1)
-    top_k_scores = []
-
-    for i in range(n_items):
-        row = similarity[i]
-        if row.shape[0] != n_items:
-            raise ValueError("Similarity matrix has invalid shape.")
-        indices = np.argsort(row)[::-1]
-        indices = [idx for idx in indices if idx != i][:top_k]
-        if indices:
-            top_k_scores.append(np.mean(row[indices]))
-
-    avg_top_k = float(np.mean(top_k_scores)) if top_k_scores else 0.0
+    neighbors = sparse.load_npz(SIMILARITY_NPZ).tocsr()
+
+    if neighbors.shape != (len(movies), len(movies)):
+        raise ValueError("Similarity matrix has invalid shape.")
+
+    # Each row stores only that movie's top-k scores, self matches excluded
+    top_k = int(np.diff(neighbors.indptr).max(initial=0))
+    avg_top_k = float(neighbors.data.mean(dtype=np.float64)) if neighbors.nnz else 0.0
+
     print(f"Movies in model: {len(movies)}")
     print(f"Avg top-{top_k} cosine similarity: {avg_top_k:.4f}")
 
@@ -1,6 +1,30 @@
+import time
+from collections import OrderedDict
+
 from fastapi import Request, HTTPException, status
 from auth import verify_token
 
+# Verified tokens -> (cache expiry, claims); entries never outlive the token's own exp
+TOKEN_CACHE_SIZE = 4096
+TOKEN_CACHE_TTL = 300
+_token_cache: "OrderedDict[str, tuple]" = OrderedDict()
+
+
+def verify_token_cached(token: str) -> dict:
+    """verify_token with an LRU of recently verified tokens"""
+    now = time.time()
+    cached = _token_cache.get(token)
+    if cached and cached[0] > now:
+        _token_cache.move_to_end(token)
+        return cached[1]
+    _token_cache.pop(token, None)
+
+    payload = verify_token(token)
+    _token_cache[token] = (min(now + TOKEN_CACHE_TTL, payload.get("exp", now)), payload)
+    if len(_token_cache) > TOKEN_CACHE_SIZE:
+        _token_cache.popitem(last=False)
+    return payload
+
 
 async def auth_middleware(request: Request):
     token = request.cookies.get("access_token")
@@ -17,4 +41,4 @@ async def auth_middleware(request: Request):
             headers={"WWW-Authenticate": "Bearer"},
         )
     
-    return verify_token(token)
+    return verify_token_cached(token)
@@ -1,67 +1,173 @@
 """
 Movie service layer for handling movie-related business logic and ML data tracking
 """
-import json
+import asyncio
+import contextlib
+import functools
+import os
+from bisect import bisect_left
 from pathlib import Path
 from datetime import datetime
-from typing import List, Dict, Optional
+from typing import List, Dict, Optional, Tuple
 import uuid
 
+import aiofiles
+import numpy as np
+import orjson
 import pandas as pd
+from scipy import sparse
 import ast
 import pickle
 
 DB_PATH = Path("database.json")
+# Writes go to a temp file that is swapped in, so a crash never leaves a partial database
+DB_TMP_PATH = DB_PATH.with_suffix(DB_PATH.suffix + ".tmp")
 CSV_PATH = Path("tmdb_5000_movies.csv")
 MODEL_DIR = Path("model_data")
 MOVIES_PKL = MODEL_DIR / "movies.pkl"
-SIMILARITY_PKL = MODEL_DIR / "similarity.pkl"
+SIMILARITY_NPZ = MODEL_DIR / "similarity.npz"
+CATALOG_PARQUET = MODEL_DIR / "tmdb_5000_movies.parquet"
+CSV_COLUMNS = ["id", "title", "overview", "release_date", "vote_average", "popularity", "genres", "runtime"]
+PARSED_COLUMNS = CSV_COLUMNS + ["poster_path", "backdrop_path"]
+
+# Placeholder artwork: the URL-encoded title (or "No+Image") is appended
+POSTER_PLACEHOLDER = "https://placehold.co/500x750/1a1a2e/FFF?text="
+BACKDROP_PLACEHOLDER = "https://placehold.co/1920x1080/1a1a2e/FFF?text="
+
+# Seconds to wait before flushing database changes, so bursts coalesce into one write
+DB_FLUSH_DELAY = 0.5
+
+# View/search events are appended here and folded into database.json periodically
+EVENTS_PATH = Path("events.jsonl")
+# A batch being replayed is moved here so new events never land in it
+EVENTS_REPLAY_PATH = Path("events.jsonl.replaying")
+EVENTS_REPLAY_INTERVAL = 30
 
 # Global cache for CSV movies
 _CSV_MOVIES_CACHE = []
+_CSV_MOVIES_BY_ID: Dict[int, dict] = {}
+# Precomputed per-category orderings of the CSV catalog
+_SORT_IDX: Dict[str, np.ndarray] = {}
+# (lowercased title, position) pairs sorted for bisect prefix search
+_TITLE_SORTED: List[Tuple[str, int]] = []
 _RECOMMENDER_MOVIES = None
-_RECOMMENDER_SIMILARITY = None
+_RECOMMENDER_NEIGHBORS = None
+_REC_IDS: List[Optional[int]] = []
+_REC_TITLES: List[str] = []
+_REC_TITLE_TO_IDX: Dict[str, int] = {}
+_REC_TITLE_SORTED: List[Tuple[str, int]] = []
+
+# In-memory database cache with debounced write-behind to DB_PATH
+_DB_CACHE: Optional[dict] = None
+_DB_DIRTY = False
+_DB_LOCK = asyncio.Lock()
+_DB_LOOP: Optional[asyncio.AbstractEventLoop] = None
+_DB_FLUSH_TASK: Optional[asyncio.Task] = None
+_EVENTS_LOCK = asyncio.Lock()
+_EVENTS_TASK: Optional[asyncio.Task] = None
+# True once the batch in EVENTS_REPLAY_PATH is in memory but not yet flushed
+_REPLAY_APPLIED = False
+
+# Lookup indexes over the cached database, kept in sync on mutation
+_users_by_name: Dict[str, dict] = {}
+_users_by_email: Dict[str, dict] = {}
+_movies_by_id: Dict[int, dict] = {}
+
+def _parse_genres(value) -> Optional[List[str]]:
+    """Parse the first three genre names from the CSV's JSON string (None if malformed)"""
+    try:
+        return [g['name'] for g in ast.literal_eval(value)][:3]
+    except Exception:
+        return None
+
+
+def _load_catalog_columns() -> Dict[str, list]:
+    """Load the parsed catalog as column lists from Parquet, re-parsing the CSV when it is stale"""
+    parquet_fresh = CATALOG_PARQUET.exists() and (
+        not CSV_PATH.exists() or CATALOG_PARQUET.stat().st_mtime >= CSV_PATH.stat().st_mtime
+    )
+    if parquet_fresh:
+        try:
+            columns = pd.read_parquet(CATALOG_PARQUET, columns=PARSED_COLUMNS).to_dict(orient="list")
+            # List columns come back as arrays
+            columns['genres'] = [list(g) for g in columns['genres']]
+            return columns
+        except Exception as e:
+            print(f"Ignoring unreadable {CATALOG_PARQUET}: {e}")
+
+    df = pd.read_csv(CSV_PATH, usecols=CSV_COLUMNS)
+    df = df[df['title'].notna()]
+
+    # Genres are the only per-row parse; rows with malformed genres are skipped
+    genres = [_parse_genres(value) for value in df['genres'].tolist()]
+    valid = [g is not None for g in genres]
+    skipped = len(valid) - sum(valid)
+    if skipped:
+        print(f"Skipping {skipped} movies with unparseable genres")
+    df = df[valid]
+
+    slugs = df['title'].str.replace(' ', '+', regex=False)
+    df = df.assign(
+        id=df['id'].astype(int),
+        overview=df['overview'].fillna("No overview available."),
+        release_date=df['release_date'].fillna(""),
+        vote_average=df['vote_average'].astype(float),
+        popularity=df['popularity'].astype(float),
+        runtime=df['runtime'].fillna(0).astype(int),
+        genres=[g for g in genres if g is not None],
+        poster_path=POSTER_PLACEHOLDER + slugs,
+        backdrop_path=BACKDROP_PLACEHOLDER + slugs,
+    )
+
+    try:
+        MODEL_DIR.mkdir(parents=True, exist_ok=True)
+        df[PARSED_COLUMNS].to_parquet(CATALOG_PARQUET, compression="zstd", index=False)
+    except Exception as e:
+        print(f"Could not cache parsed CSV to {CATALOG_PARQUET}: {e}")
+
+    return df.to_dict(orient="list")
+
 
 def load_csv_movies() -> List[dict]:
     """Load and parse movies from CSV"""
-    global _CSV_MOVIES_CACHE
+    global _CSV_MOVIES_CACHE, _CSV_MOVIES_BY_ID, _SORT_IDX, _TITLE_SORTED
     if _CSV_MOVIES_CACHE:
         return _CSV_MOVIES_CACHE
         
-    if not CSV_PATH.exists():
+    if not CSV_PATH.exists() and not CATALOG_PARQUET.exists():
         print(f"Error: {CSV_PATH} not found")
         return []
 
     try:
-        df = pd.read_csv(CSV_PATH)
+        columns = _load_catalog_columns()
         movies = []
-        
-        for _, row in df.iterrows():
-            try:
-                # Parse genres from JSON string
-                genres = [g['name'] for g in ast.literal_eval(row['genres'])]
-                
-                movie = {
-                    "id": int(row['id']),
-                    "tmdb_id": int(row['id']), # Compatibility
-                    "title": row['title'],
-                    "overview": row['overview'] if pd.notna(row['overview']) else "No overview available.",
-                    "poster_path": f"https://placehold.co/500x750/1a1a2e/FFF?text={row['title'].replace(' ', '+')}",
-                    "backdrop_path": f"https://placehold.co/1920x1080/1a1a2e/FFF?text={row['title'].replace(' ', '+')}",
-                    "release_date": row['release_date'] if pd.notna(row['release_date']) else "",
-                    "vote_average": float(row['vote_average']),
-                    "popularity": float(row['popularity']),
-                    "genres": genres[:3],
-                    "runtime": int(row['runtime']) if pd.notna(row['runtime']) else 0,
-                    "like_count": 0,
-                    "is_tmdb": True # Treat as "remote" source for compatibility
-                }
-                movies.append(movie)
-            except Exception as e:
-                print(f"Skipping movie {row.get('title', 'Unknown')}: {e}")
-                continue
-                
+        for values in zip(*(columns[c] for c in PARSED_COLUMNS)):
+            movie = dict(zip(PARSED_COLUMNS, values))
+            movie["tmdb_id"] = movie["id"] # Compatibility
+            movie["like_count"] = 0
+            movie["is_tmdb"] = True # Treat as "remote" source for compatibility
+            movies.append(movie)
+
+        # Columnar copies of the sort keys; release dates become YYYYMMDD ints (0 if missing)
+        release_key = pd.to_numeric(
+            pd.Series(columns['release_date'], dtype=object).str.replace("-", "", regex=False),
+            errors="coerce",
+        ).fillna(0).astype(np.int64).to_numpy()
+        soa = {
+            "popularity": np.asarray(columns['popularity'], dtype=np.float64),
+            "vote_average": np.asarray(columns['vote_average'], dtype=np.float64),
+            "release_key": release_key,
+        }
+
+        # Descending stable sorts, so ties keep CSV order like sorted(..., reverse=True)
+        _SORT_IDX = {
+            "popular": np.argsort(-soa["popularity"], kind="stable"),
+            "top_rated": np.argsort(-soa["vote_average"], kind="stable"),
+            "upcoming": np.argsort(-soa["release_key"], kind="stable"),
+        }
+        _TITLE_SORTED = sorted((title.lower(), i) for i, title in enumerate(columns['title']))
         _CSV_MOVIES_CACHE = movies
+        _CSV_MOVIES_BY_ID = {m["id"]: m for m in movies}
         print(f"Loaded {len(movies)} movies from CSV")
         
         return movies
@@ -69,69 +175,208 @@ def load_csv_movies() -> List[dict]:
         print(f"Error loading CSV: {e}")
         return []
 
+def _prefix_matches(sorted_titles: List[Tuple[str, int]], prefix: str) -> List[Tuple[str, int]]:
+    """Return the (title, position) pairs whose title starts with prefix"""
+    lo = bisect_left(sorted_titles, (prefix,))
+    hi = lo
+    while hi < len(sorted_titles) and sorted_titles[hi][0].startswith(prefix):
+        hi += 1
+    return sorted_titles[lo:hi]
+
+
+def _movies_at(indices) -> List[dict]:
+    """Copy catalog rows by position so callers can annotate them without touching the cache"""
+    return [dict(_CSV_MOVIES_CACHE[int(i)]) for i in indices]
+
+
 def get_movies_by_category(category: str, limit: int = 20, offset: int = 0) -> dict:
     """Get movies sorted by category"""
     movies = load_csv_movies()
-    
-    if category == "top_rated":
-        # Sort by vote_average
-        sorted_movies = sorted(movies, key=lambda x: x["vote_average"], reverse=True)
-    elif category == "upcoming":
-        # Sort by release_date (descending for now as 'upcoming' implies future/recent)
-        # Note: Dataset is old, so 'upcoming' is relative or just 'newest'
-        sorted_movies = sorted(movies, key=lambda x: x["release_date"] or "", reverse=True)
-    else: # popular
-        sorted_movies = sorted(movies, key=lambda x: x["popularity"], reverse=True)
-        
-    total = len(sorted_movies)
-    paginated = sorted_movies[offset : offset + limit]
+    if not movies:
+        return {"results": [], "total_results": 0}
+
+    # "upcoming" is newest-first: the dataset is old, so it is relative
+    order = _SORT_IDX.get(category, _SORT_IDX["popular"])
+    paginated = _movies_at(order[offset : offset + limit])
     
     return {
         "results": paginated,
-        "total_results": total
+        "total_results": len(movies)
     }
 
 
 def read_db() -> dict:
-    """Read database file"""
-    if not DB_PATH.exists():
-        return {"users": [], "movies": [], "comments": []}
-    with open(DB_PATH, "r") as f:
-        return json.load(f)
+    """Return the in-memory database, loading it from disk on first use"""
+    global _DB_CACHE
+    if _DB_CACHE is None:
+        _DB_CACHE = _parse_db(DB_PATH.read_bytes() if DB_PATH.exists() else None)
+    return _DB_CACHE
+
+
+def _parse_db(raw: Optional[bytes]) -> dict:
+    """Parse database.json contents (None: no file yet) and index the result"""
+    db = orjson.loads(raw) if raw is not None else {"users": [], "movies": [], "comments": []}
+    _build_indexes(db)
+    return db
+
+
+def _build_indexes(db: dict):
+    """Rebuild the username/email/movie lookup indexes (first entry wins)"""
+    global _users_by_name, _users_by_email, _movies_by_id
+    _users_by_name, _users_by_email, _movies_by_id = {}, {}, {}
+    for user in db.get("users", []):
+        _users_by_name.setdefault(user["username"], user)
+        _users_by_email.setdefault(user["email"], user)
+    for movie in db.get("movies", []):
+        _movies_by_id.setdefault(movie["id"], movie)
+
+
+def get_user(username: str) -> Optional[dict]:
+    """Get a user by username"""
+    read_db()
+    return _users_by_name.get(username)
+
+
+def get_user_by_email(email: str) -> Optional[dict]:
+    """Get a user by email"""
+    read_db()
+    return _users_by_email.get(email)
+
+
+def get_liked_ids(username: str) -> frozenset:
+    """Ids of the movies a user has liked, as a set for O(1) membership checks"""
+    return _liked_ids(get_user(username))
+
+
+def _liked_ids(user: Optional[dict]) -> frozenset:
+    return frozenset(user.get("liked_movies", ())) if user else frozenset()
+
+
+def add_user(user: dict):
+    """Append a new user to the database"""
+    db = read_db()
+    db["users"].append(user)
+    _users_by_name.setdefault(user["username"], user)
+    _users_by_email.setdefault(user["email"], user)
+    write_db(db)
 
 
 def write_db(data: dict):
-    """Write to database file"""
-    with open(DB_PATH, "w") as f:
-        json.dump(data, f, indent=2)
+    """Mark the database as changed and schedule a debounced flush to disk"""
+    global _DB_CACHE, _DB_DIRTY
+    if data is not _DB_CACHE:
+        _build_indexes(data)
+    _DB_CACHE = data
+    _DB_DIRTY = True
+
+    try:
+        loop = asyncio.get_running_loop()
+    except RuntimeError:
+        loop = _DB_LOOP
+
+    if loop is None or loop.is_closed():
+        # No event loop (e.g. running from a script): write straight through
+        _DB_DIRTY = False
+        DB_TMP_PATH.write_bytes(_dump_db(data))
+        os.replace(DB_TMP_PATH, DB_PATH)
+        return
+
+    # Handlers running in the threadpool hand the flush over to the event loop
+    loop.call_soon_threadsafe(_schedule_flush)
+
+
+def _dump_db(data: dict) -> bytes:
+    return orjson.dumps(data, option=orjson.OPT_INDENT_2)
+
+
+def _schedule_flush():
+    """Start a flush task unless one is already waiting"""
+    global _DB_FLUSH_TASK
+    if _DB_FLUSH_TASK is None or _DB_FLUSH_TASK.done():
+        _DB_FLUSH_TASK = asyncio.create_task(_flush_db(DB_FLUSH_DELAY))
+
+
+async def _flush_db(delay: float = 0):
+    """Write the cached database to disk until no changes are left unflushed"""
+    global _DB_DIRTY
+    while True:
+        if delay:
+            await asyncio.sleep(delay)
+
+        async with _DB_LOCK:
+            if not _DB_DIRTY or _DB_CACHE is None:
+                return
+            _DB_DIRTY = False
+            payload = _dump_db(_DB_CACHE)
+
+            try:
+                async with aiofiles.open(DB_TMP_PATH, "wb") as f:
+                    await f.write(payload)
+                os.replace(DB_TMP_PATH, DB_PATH)
+            except BaseException:
+                # Keep the changes pending so the next flush retries them
+                _DB_DIRTY = True
+                raise
+        # Writes made while this flush was on disk go out in another round
+
+
+async def load_db() -> dict:
+    """Load the database from disk into the cache without blocking the event loop"""
+    global _DB_CACHE
+    raw = None
+    if DB_PATH.exists():
+        async with aiofiles.open(DB_PATH, "rb") as f:
+            raw = await f.read()
+    _DB_CACHE = _parse_db(raw)
+    return _DB_CACHE
+
+
+async def init_db():
+    """Preload the database and bind write-behind flushes to the running loop"""
+    global _DB_LOOP, _EVENTS_TASK
+    _DB_LOOP = asyncio.get_running_loop()
+    await load_db()
+    await replay_events()
+    _EVENTS_TASK = asyncio.create_task(_replay_events_periodically())
+
+
+async def close_db():
+    """Replay logged events and flush any pending database changes (called on shutdown)"""
+    if _EVENTS_TASK is not None:
+        _EVENTS_TASK.cancel()
+        # Let a replay that was mid-flush unwind before the final one starts
+        with contextlib.suppress(asyncio.CancelledError):
+            await _EVENTS_TASK
+    await replay_events()
+    await _flush_db()
+    if _DB_FLUSH_TASK is not None and not _DB_FLUSH_TASK.done():
+        _DB_FLUSH_TASK.cancel()
 
 
 def get_all_movies(limit: Optional[int] = None, offset: int = 0) -> List[dict]:
     """Get all movies from CSV (default sort by popularity)"""
     # Use load_csv_movies instead of local DB for the main feed
-    movies = load_csv_movies()
+    if not load_csv_movies():
+        return []
     # Sort by popularity by default
-    movies.sort(key=lambda x: x['popularity'], reverse=True)
+    order = _SORT_IDX["popular"]
     
     if limit:
-        return movies[offset:offset + limit]
-    return movies[offset:]
+        return _movies_at(order[offset:offset + limit])
+    return _movies_at(order[offset:])
 
 
 def get_movie_by_id(movie_id: int) -> Optional[dict]:
     """Get a specific movie by ID (check CSV first, then local DB)"""
     # Check CSV
-    csv_movies = load_csv_movies()
-    for movie in csv_movies:
-        if movie["id"] == movie_id:
-            return movie
-            
+    load_csv_movies()
+    movie = _CSV_MOVIES_BY_ID.get(movie_id)
+    if movie:
+        return movie
+
     # Check local DB (legacy/user added)
-    db = read_db()
-    for movie in db.get("movies", []):
-        if movie["id"] == movie_id:
-            return movie
-    return None
+    read_db()
+    return _movies_by_id.get(movie_id)
 
 
 def search_movies(query: str) -> List[dict]:
@@ -139,10 +384,8 @@ def search_movies(query: str) -> List[dict]:
     query_lower = query.lower().strip()
     if not query_lower:
         return []
-        
-    results = []
 
-    # Search local DB first (user-added movies)
+    # Search local DB first (user-added movies); it changes at runtime, so it is not cached
     db = read_db()
     db_matches = []
     for movie in db.get("movies", []):
@@ -156,76 +399,32 @@ def search_movies(query: str) -> List[dict]:
             len(str(m.get("title", "")))
         )
     )
-    
-    # Search CSV using Pandas
-    # Ensure movies are loaded
-    if not _CSV_MOVIES_CACHE:
-        load_csv_movies()
-
-    # Re-read CSV into DataFrame if needed, or better, we should cache the DataFrame.
-    # For now, let's load it if not available, but 'load_csv_movies' returns a list of dicts.
-    # We should really optimize this, but let's follow the user's request to "create pandas".
-    
-    # Efficiently, we should have the DF cached. 
-    # Let's read the CSV just for this search as the user requested "create pandas for csv so you can search".
-    # Note: efficient apps would cache the DF. 
-    
-    try:
-        df = pd.read_csv(CSV_PATH)
-        
-        # Filter: starts with query (case insensitive)
-        # Using na=False to handle potential NaNs
-        mask = df['title'].str.lower().str.startswith(query_lower, na=False)
-        matched_df = df[mask]
-        
-        # Sort by exact match then length
-        # Create a temp column for length
-        matched_df = matched_df.copy()
-        matched_df['title_len'] = matched_df['title'].str.len()
-        matched_df['exact_match'] = matched_df['title'].str.lower() == query_lower
-        
-        # Sort: exact match (True > False), then length (asc)
-        matched_df = matched_df.sort_values(by=['exact_match', 'title_len'], ascending=[False, True])
-        
-        # Convert to list of dicts (format matching load_csv_movies output)
-        results = []
-        for _, row in matched_df.head(50).iterrows():
-            try:
-                # Re-use logic to parse row to dict similar to load_csv_movies
-                genres = [g['name'] for g in ast.literal_eval(row['genres'])]
-                movie = {
-                    "id": int(row['id']),
-                    "tmdb_id": int(row['id']),
-                    "title": row['title'],
-                    "overview": row['overview'] if pd.notna(row['overview']) else "No overview available.",
-                    "poster_path": f"https://placehold.co/500x750/1a1a2e/FFF?text={row['title'].replace(' ', '+')}",
-                    "backdrop_path": f"https://placehold.co/1920x1080/1a1a2e/FFF?text={row['title'].replace(' ', '+')}",
-                    "release_date": row['release_date'] if pd.notna(row['release_date']) else "",
-                    "vote_average": float(row['vote_average']),
-                    "popularity": float(row['popularity']),
-                    "genres": genres[:3],
-                    "runtime": int(row['runtime']) if pd.notna(row['runtime']) else 0,
-                    "like_count": 0,
-                    "is_tmdb": True
-                }
-                results.append(movie)
-            except Exception:
-                continue
-
-        # Merge DB matches first, then CSV results (dedupe by id)
-        merged = []
-        seen_ids = set()
-        for movie in db_matches + results:
-            movie_id = movie.get("id")
-            if movie_id in seen_ids:
-                continue
-            merged.append(movie)
-            seen_ids.add(movie_id)
-        return merged
 
-    except Exception as e:
-        print(f"Pandas search error: {e}")
-        return db_matches
+    # Merge DB matches first, then CSV results (dedupe by id)
+    csv_matches = (_CSV_MOVIES_BY_ID[movie_id] for movie_id in _search_catalog(query_lower))
+    results = []
+    seen_ids = set()
+    for movie in [*db_matches, *csv_matches]:
+        movie_id = movie.get("id")
+        if movie_id in seen_ids:
+            continue
+        # Copies, so callers can annotate results without touching the DB or the cache
+        results.append(dict(movie))
+        seen_ids.add(movie_id)
+    return results
+
+
+@functools.lru_cache(maxsize=2048)
+def _search_catalog(query_lower: str) -> Tuple[int, ...]:
+    """Ids of the best CSV title matches for a query; the catalog never changes"""
+    if not load_csv_movies():
+        return ()
+    # Search the cached CSV catalog: title starts with query (case insensitive)
+    matched = _prefix_matches(_TITLE_SORTED, query_lower)
+
+    # Sort: exact match first, then length (asc), ties in CSV order
+    matched.sort(key=lambda m: (m[0] != query_lower, len(m[0]), m[1]))
+    return tuple(_CSV_MOVIES_CACHE[i]["id"] for _, i in matched[:50])
 
 
 def like_movie(username: str, movie_id: int) -> dict:
@@ -233,21 +432,13 @@ def like_movie(username: str, movie_id: int) -> dict:
     db = read_db()
     
     # Find user
-    user = None
-    for u in db["users"]:
-        if u["username"] == username:
-            user = u
-            break
+    user = _users_by_name.get(username)
     
     if not user:
         return {"success": False, "message": "User not found"}
     
     # Find movie in DB, or seed from CSV if needed
-    movie = None
-    for m in db.get("movies", []):
-        if m["id"] == movie_id:
-            movie = m
-            break
+    movie = _movies_by_id.get(movie_id)
 
     if not movie:
         csv_movie = get_movie_by_id(movie_id)
@@ -256,6 +447,7 @@ def like_movie(username: str, movie_id: int) -> dict:
         movie = dict(csv_movie)
         movie.setdefault("like_count", 0)
         db.setdefault("movies", []).append(movie)
+        _movies_by_id[movie_id] = movie
     
     # Toggle like
     if "liked_movies" not in user:
@@ -286,7 +478,7 @@ def add_comment(username: str, movie_id: int, text: str) -> dict:
     db = read_db()
     
     # Verify movie exists
-    movie_exists = any(m["id"] == movie_id for m in db.get("movies", []))
+    movie_exists = movie_id in _movies_by_id
     if not movie_exists:
         movie_exists = get_movie_by_id(movie_id) is not None
     if not movie_exists:
@@ -319,91 +511,145 @@ def get_movie_comments(movie_id: int) -> List[dict]:
     return comments
 
 
-def track_movie_view(username: str, movie_id: int):
-    """Track when a user views a movie (for ML)"""
-    db = read_db()
-    
-    # Find user
-    for user in db["users"]:
-        if user["username"] == username:
-            if "viewed_movies" not in user:
-                user["viewed_movies"] = []
-            
-            # Add view with timestamp
-            view_entry = {
-                "movie_id": movie_id,
-                "timestamp": datetime.utcnow().isoformat()
-            }
-            user["viewed_movies"].append(view_entry)
-            
-            # Keep only last 100 views per user to prevent database bloat
-            if len(user["viewed_movies"]) > 100:
-                user["viewed_movies"] = user["viewed_movies"][-100:]
-            
-            write_db(db)
-            return True
-    
-    return False
+async def _log_event(event: dict):
+    """Append one tracking event to the log (a single O_APPEND write)"""
+    async with _EVENTS_LOCK:
+        async with aiofiles.open(EVENTS_PATH, "ab") as f:
+            await f.write(orjson.dumps(event) + b"\n")
 
 
-def track_search(username: str, query: str):
-    """Track user search queries (for ML)"""
+async def _log_view(username: str, movie_id: int):
+    await _log_event({
+        "kind": "view",
+        "username": username,
+        "movie_id": movie_id,
+        "timestamp": datetime.utcnow().isoformat()
+    })
+
+
+async def _log_search(username: str, query: str):
+    await _log_event({
+        "kind": "search",
+        "username": username,
+        "query": query,
+        "timestamp": datetime.utcnow().isoformat()
+    })
+
+
+async def get_movie_with_context(username: str, movie_id: int) -> Optional[dict]:
+    """Get a movie annotated with the user's like status, tracking the view (one user lookup)"""
+    movie = get_movie_by_id(movie_id)
+    if not movie:
+        return None
+
+    user = get_user(username)
+    if user:
+        await _log_view(username, movie_id)
+
+    # Annotate a copy; the catalog entry is shared
+    return {**movie, "is_liked": movie_id in _liked_ids(user)}
+
+
+async def search_with_context(username: str, query: str) -> Tuple[List[dict], List[dict]]:
+    """Search results and recommendations annotated for the user, tracking the search"""
+    user = get_user(username)
+    if user:
+        await _log_search(username, query)
+
+    # Both lookups are CPU-bound; keep them off the event loop
+    results = await asyncio.to_thread(search_movies, query)
+    recommendations = await asyncio.to_thread(get_similar_movies, query)
+
+    liked = _liked_ids(user)
+    for movie in results + recommendations:
+        movie["is_liked"] = movie.get("id") in liked
+    return results, recommendations
+
+
+async def replay_events() -> int:
+    """Fold logged views/searches into user histories, then clear the log.
+
+    Each batch is applied to memory exactly once; a failed flush only retries the flush.
+    """
+    global _REPLAY_APPLIED
+    async with _EVENTS_LOCK:
+        replayed = 0
+        if not _REPLAY_APPLIED:
+            # A leftover batch (e.g. from a crash) goes first; new events wait for the next round
+            if not EVENTS_REPLAY_PATH.exists():
+                if not EVENTS_PATH.exists():
+                    return 0
+                os.replace(EVENTS_PATH, EVENTS_REPLAY_PATH)
+            async with aiofiles.open(EVENTS_REPLAY_PATH, "rb") as f:
+                lines = (await f.read()).splitlines()
+            replayed = _apply_events(lines)
+            _REPLAY_APPLIED = True
+
+        # Persist the histories before dropping the events they came from
+        await _flush_db()
+        EVENTS_REPLAY_PATH.unlink(missing_ok=True)
+        _REPLAY_APPLIED = False
+        return replayed
+
+
+def _apply_events(lines: List[bytes]) -> int:
+    """Append logged events to the cached user histories"""
+    if not lines:
+        return 0
+
     db = read_db()
-    
-    # Find user
-    for user in db["users"]:
-        if user["username"] == username:
-            if "search_history" not in user:
-                user["search_history"] = []
-            
-            # Add search with timestamp
-            search_entry = {
-                "query": query,
-                "timestamp": datetime.utcnow().isoformat()
-            }
-            user["search_history"].append(search_entry)
-            
-            # Keep only last 50 searches per user
-            if len(user["search_history"]) > 50:
-                user["search_history"] = user["search_history"][-50:]
-            
-            write_db(db)
-            return True
-    
-    return False
+    touched = {}
+    for line in lines:
+        try:
+            event = orjson.loads(line)
+            user = _users_by_name.get(event["username"])
+            if event["kind"] == "view":
+                key, entry = "viewed_movies", {"movie_id": event["movie_id"]}
+            else:
+                key, entry = "search_history", {"query": event["query"]}
+            entry["timestamp"] = event["timestamp"]
+        except Exception as e:
+            print(f"Skipping malformed event: {e}")
+            continue
+        if not user:
+            continue
+        user.setdefault(key, []).append(entry)
+        touched[id(user)] = user
+
+    # Keep only the last 100 views / 50 searches per user to prevent database bloat
+    for user in touched.values():
+        user["viewed_movies"] = user.get("viewed_movies", [])[-100:]
+        user["search_history"] = user.get("search_history", [])[-50:]
+
+    write_db(db)
+    return len(lines)
+
+
+async def _replay_events_periodically():
+    while True:
+        await asyncio.sleep(EVENTS_REPLAY_INTERVAL)
+        try:
+            await replay_events()
+        except Exception as e:
+            print(f"Event replay failed: {e}")
 
 
 def get_user_liked_movies(username: str) -> List[dict]:
     """Get all movies liked by a user"""
-    db = read_db()
-    
-    # Find user
-    user = None
-    for u in db["users"]:
-        if u["username"] == username:
-            user = u
-            break
+    user = get_user(username)
     
     if not user or "liked_movies" not in user:
         return []
     
     # Get full movie objects
-    liked_movie_ids = user["liked_movies"]
-    movies = [m for m in db.get("movies", []) if m["id"] in liked_movie_ids]
+    movies = [_movies_by_id[i] for i in user["liked_movies"] if i in _movies_by_id]
     
     return movies
 
 
 def get_user_stats(username: str) -> dict:
     """Get user statistics for ML insights"""
-    db = read_db()
-    
-    # Find user
-    user = None
-    for u in db["users"]:
-        if u["username"] == username:
-            user = u
-            break
+    user = get_user(username)
     
     if not user:
         return {}
@@ -415,9 +661,9 @@ def get_user_stats(username: str) -> dict:
     
     # Get genre preferences from liked movies
     genre_counts = {}
-    liked_movie_ids = user.get("liked_movies", [])
-    for movie in db.get("movies", []):
-        if movie["id"] in liked_movie_ids:
+    for movie_id in user.get("liked_movies", []):
+        movie = _movies_by_id.get(movie_id)
+        if movie:
             for genre in movie["genres"]:
                 genre_counts[genre] = genre_counts.get(genre, 0) + 1
     
@@ -431,59 +677,83 @@ def get_user_stats(username: str) -> dict:
     }
 
 
-def get_similar_movies(movie_title: str) -> List[dict]:
-    """Get similar movies using precomputed similarity PKLs"""
-    global _CSV_MOVIES_CACHE, _RECOMMENDER_MOVIES, _RECOMMENDER_SIMILARITY
+def load_recommender() -> bool:
+    """Load the recommender titles and precomputed neighbours (once)"""
+    global _RECOMMENDER_MOVIES, _RECOMMENDER_NEIGHBORS, _REC_IDS, _REC_TITLES
+    global _REC_TITLE_TO_IDX, _REC_TITLE_SORTED
 
-    # Ensure catalog loaded
-    if not _CSV_MOVIES_CACHE:
-        load_csv_movies()
+    if _RECOMMENDER_MOVIES is not None and _RECOMMENDER_NEIGHBORS is not None:
+        return True
 
-    if _RECOMMENDER_MOVIES is None or _RECOMMENDER_SIMILARITY is None:
-        if not MOVIES_PKL.exists() or not SIMILARITY_PKL.exists():
-            print("Recommender PKL files not found. Run scripts/build_recommender.py")
-            return []
-        try:
-            with open(MOVIES_PKL, "rb") as f:
-                _RECOMMENDER_MOVIES = pickle.load(f)
-            with open(SIMILARITY_PKL, "rb") as f:
-                _RECOMMENDER_SIMILARITY = pickle.load(f)
-        except Exception as e:
-            print(f"Failed to load recommender PKLs: {e}")
-            return []
+    if not MOVIES_PKL.exists() or not SIMILARITY_NPZ.exists():
+        print("Recommender model files not found. Run scripts/build_recommender.py")
+        return False
+    try:
+        with open(MOVIES_PKL, "rb") as f:
+            rec_movies = pickle.load(f)
+        # Sparse rows: each holds only a movie's nearest neighbours and their scores
+        neighbors = sparse.load_npz(SIMILARITY_NPZ).tocsr()
+    except Exception as e:
+        print(f"Failed to load recommender model: {e}")
+        return False
+
+    _REC_TITLES = rec_movies["title"].tolist()
+    if "id" in rec_movies:
+        _REC_IDS = [int(v) for v in rec_movies["id"].tolist()]
+    else:
+        _REC_IDS = [None] * len(_REC_TITLES)
+
+    lower_titles = rec_movies["title"].astype(str).str.lower().tolist()
+    _REC_TITLE_TO_IDX = {}
+    for i, title in enumerate(lower_titles):
+        _REC_TITLE_TO_IDX.setdefault(title, i)
+    _REC_TITLE_SORTED = sorted((title, i) for i, title in enumerate(lower_titles))
+
+    _RECOMMENDER_MOVIES = rec_movies
+    _RECOMMENDER_NEIGHBORS = neighbors
+    return True
+
+
+@functools.lru_cache(maxsize=2048)
+def _similar_cached(query: str) -> Tuple[int, ...]:
+    """Recommender positions of the 10 movies most similar to the query's best title match"""
+    # Exact title first, otherwise the earliest movie whose title starts with the query
+    idx = _REC_TITLE_TO_IDX.get(query)
+    if idx is None:
+        starts = _prefix_matches(_REC_TITLE_SORTED, query)
+        if not starts:
+            return ()
+        idx = min(i for _, i in starts)
+
+    start, end = _RECOMMENDER_NEIGHBORS.indptr[idx], _RECOMMENDER_NEIGHBORS.indptr[idx + 1]
+    scores = _RECOMMENDER_NEIGHBORS.data[start:end]
+    neighbors = _RECOMMENDER_NEIGHBORS.indices[start:end]
+    return tuple(neighbors[np.argsort(-scores, kind="stable")][:10].tolist())
+
+
+def get_similar_movies(movie_title: str) -> List[dict]:
+    """Get similar movies using the precomputed nearest neighbours"""
+    # Ensure catalog loaded
+    load_csv_movies()
+    if not load_recommender():
+        return []
 
     try:
-        titles = _RECOMMENDER_MOVIES["title"].astype(str)
-        lower_titles = titles.str.lower()
-        query = movie_title.lower().strip()
-
-        matches = lower_titles == query
-        if matches.any():
-            idx = matches.idxmax()
-        else:
-            starts = lower_titles.str.startswith(query)
-            if not starts.any():
-                return []
-            idx = starts.idxmax()
-
-        sims = _RECOMMENDER_SIMILARITY[idx]
-        similar_idx = sorted(range(len(sims)), key=lambda i: sims[i], reverse=True)
-        similar_idx = [i for i in similar_idx if i != idx][:10]
-
-        movie_map = {m["id"]: m for m in _CSV_MOVIES_CACHE}
+        similar_idx = _similar_cached(movie_title.lower().strip())
+
         recommendations = []
         for i in similar_idx:
-            movie_id = _RECOMMENDER_MOVIES.iloc[i].get("id")
-            movie = movie_map.get(int(movie_id)) if movie_id is not None else None
+            movie_id = _REC_IDS[i]
+            movie = _CSV_MOVIES_BY_ID.get(movie_id) if movie_id is not None else None
             if movie:
-                recommendations.append(movie)
+                recommendations.append(dict(movie))
             else:
                 recommendations.append({
-                    "id": int(movie_id) if movie_id is not None else i,
-                    "title": _RECOMMENDER_MOVIES.iloc[i]["title"],
+                    "id": movie_id if movie_id is not None else i,
+                    "title": _REC_TITLES[i],
                     "overview": "No overview available.",
-                    "poster_path": "https://placehold.co/500x750/1a1a2e/FFF?text=No+Image",
-                    "backdrop_path": "https://placehold.co/1920x1080/1a1a2e/FFF?text=No+Image",
+                    "poster_path": POSTER_PLACEHOLDER + "No+Image",
+                    "backdrop_path": BACKDROP_PLACEHOLDER + "No+Image",
                     "release_date": "",
                     "vote_average": 0.0,
                     "genres": [],
@@ -1,25 +1,39 @@
-import ast
 import pickle
 import re
+from functools import lru_cache
 from pathlib import Path
 
+import numpy as np
+import orjson
 import pandas as pd
-from sklearn.feature_extraction.text import TfidfVectorizer
-from sklearn.metrics.pairwise import cosine_similarity
+import pyarrow as pa
+import pyarrow.compute as pc
+from scipy import sparse
+from sklearn.feature_extraction.text import HashingVectorizer, TfidfVectorizer
+from sklearn.preprocessing import normalize
 
 
 BASE_DIR = Path(__file__).resolve().parents[1]
 MODEL_DIR = BASE_DIR / "model_data"
 MOVIES_PKL = MODEL_DIR / "movies.pkl"
-SIMILARITY_PKL = MODEL_DIR / "similarity.pkl"
-
-
-def load_csv(path: Path) -> pd.DataFrame:
-    if path.suffix == ".zip":
-        return pd.read_csv(path)
-    return pd.read_csv(path)
-
-
+SIMILARITY_NPZ = MODEL_DIR / "similarity.npz"
+TOP_K = 10
+# Side of the square similarity blocks densified at once (4 MB in float32)
+BLOCK_ROWS = 1024
+LIST_COLUMNS = ["genres", "keywords", "production_companies", "production_countries"]
+CSV_COLUMNS = ["id", "title", "overview"] + LIST_COLUMNS
+TEXT_DTYPE = "string[pyarrow]"
+# Company/country names are hashed into a small block weighted below the text features
+PRODUCTION_FEATURES = 512
+PRODUCTION_WEIGHT = 0.5
+
+# Any run of characters outside [a-z0-9] collapses to a single space
+_NONALNUM = re.compile(r"[^a-z0-9]+")
+# Non-empty "name" values inside the TMDB JSON lists
+_NAME_RE = re.compile(r'"name":\s*"([^"]+)"')
+
+
+@lru_cache(maxsize=4)
 def find_dataset(name: str) -> Path:
     candidates = [
         BASE_DIR / f"{name}.csv",
@@ -31,69 +45,141 @@ def find_dataset(name: str) -> Path:
     raise FileNotFoundError(f"Missing dataset: {name}.csv or {name}.csv.zip")
 
 
+# TMDB list columns are already valid JSON, so orjson parses them with no rewriting
 def preprocess_list(value: str) -> str:
-    names = []
-    value = ast.literal_eval(value)
-    for item in value:
-        names.append(item.get("name", ""))
-    return " ".join([n for n in names if n])
+    return " ".join(n for n in (item.get("name", "") for item in orjson.loads(value)) if n)
+
 
+def extract_names(column: pd.Series) -> pd.Series:
+    """Vectorised preprocess_list: regex out the names instead of parsing JSON.
 
-def preprocess_cast(value: str) -> str:
-    names = []
-    value = ast.literal_eval(value)
-    for item in value:
-        names.append(item.get("name", ""))
-        names.append(item.get("character", ""))
-    return " ".join([n for n in names if n])
+    The few rows with backslash escapes, which the regex would cut short, are
+    parsed properly instead.
+    """
+    names = column.str.findall(_NAME_RE).str.join(" ")
+    escaped = column.str.contains("\\", regex=False, na=False)
+    if escaped.any():
+        names[escaped] = column[escaped].map(preprocess_list)
+    return names
 
 
-def clean_text(text: str) -> str:
-    if not isinstance(text, str):
-        return ""
-    text = text.lower()
-    text = re.sub(r"[^a-z0-9\\s]", " ", text)
-    text = re.sub(r"\\s+", " ", text).strip()
-    return text
+def join_clean(*columns: pd.Series) -> pd.Series:
+    """Space-join columns row-wise, lowercase, collapse non-alphanumeric runs to a
+    space and strip, in one Arrow compute pipeline.
+
+    Missing values join as empty strings; only the final array is handed back to pandas.
+    """
+    arrays = [pa.array(column, type=pa.string(), from_pandas=True) for column in columns]
+    joined = pc.binary_join_element_wise(
+        *arrays, " ", null_handling="replace", null_replacement=""
+    )
+    cleaned = pc.replace_substring_regex(
+        pc.utf8_lower(joined), pattern=_NONALNUM.pattern, replacement=" "
+    )
+    return pd.Series(
+        pd.arrays.ArrowStringArray(pc.utf8_trim_whitespace(cleaned)), index=columns[0].index
+    )
+
+
+def merge_top_k(indices: np.ndarray, scores: np.ndarray, rows: slice, block: np.ndarray, offset: int) -> None:
+    """Fold block (similarities of rows to columns offset..) into the running top-k in place"""
+    k = indices.shape[1]
+    columns = np.arange(offset, offset + block.shape[1], dtype=np.int32)
+    candidate_scores = np.concatenate([scores[rows], block], axis=1)
+    candidate_indices = np.concatenate(
+        [indices[rows], np.broadcast_to(columns, block.shape)], axis=1
+    )
+    keep = np.argpartition(candidate_scores, -k, axis=1)[:, -k:]
+    scores[rows] = np.take_along_axis(candidate_scores, keep, axis=1)
+    indices[rows] = np.take_along_axis(candidate_indices, keep, axis=1)
+
+
+def blocked_top_k(matrix: sparse.csr_matrix, k: int, block_rows: int = BLOCK_ROWS):
+    """Each row's k most similar other rows under matrix @ matrix.T, best first.
+
+    The product is symmetric, so only block pairs on or above the diagonal are
+    computed; each one feeds the top-k of both its row and its column block.
+    """
+    n_items = matrix.shape[0]
+    k = min(k, n_items - 1)
+    indices = np.zeros((n_items, k), dtype=np.int32)
+    scores = np.full((n_items, k), -np.inf, dtype=matrix.dtype)
+    bounds = [(start, min(start + block_rows, n_items)) for start in range(0, n_items, block_rows)]
+    blocks = [matrix[start:stop] for start, stop in bounds]
+    for i, (i_start, i_stop) in enumerate(bounds):
+        for j in range(i, len(bounds)):
+            j_start, j_stop = bounds[j]
+            block = (blocks[i] @ blocks[j].T).toarray()
+            if i == j:
+                np.fill_diagonal(block, -np.inf)
+            merge_top_k(indices, scores, slice(i_start, i_stop), block, j_start)
+            if i != j:
+                merge_top_k(indices, scores, slice(j_start, j_stop), block.T, i_start)
+
+    order = np.argsort(-scores, axis=1, kind="stable")
+    return np.take_along_axis(indices, order, axis=1), np.take_along_axis(scores, order, axis=1)
 
 
 def build_recommender() -> None:
     movies_path = find_dataset("tmdb_5000_movies")
-    movies = load_csv(movies_path)
-
-    movies["genres"] = movies["genres"].apply(preprocess_list)
-    movies["keywords"] = movies["keywords"].apply(preprocess_list)
-    movies["production_companies"] = movies["production_companies"].apply(preprocess_list)
-    movies["production_countries"] = movies["production_countries"].apply(preprocess_list)
-
-    movies["overview"] = movies["overview"].fillna("")
-    movies["information"] = (
-        movies["genres"]
-        + " "
-        + movies["keywords"]
-        + " "
-        + movies["overview"]
-        + " "
-        + movies["production_companies"]
-        + " "
-        + movies["production_countries"]
+    # Text columns are read straight into contiguous Arrow buffers
+    dtypes = {"id": np.int32, **{column: TEXT_DTYPE for column in CSV_COLUMNS[1:]}}
+    # read_csv infers zip compression from the suffix; plain CSVs are mmap'd
+    movies = pd.read_csv(movies_path, usecols=CSV_COLUMNS, dtype=dtypes, memory_map=True)
+
+    for column in LIST_COLUMNS:
+        movies[column] = extract_names(movies[column])
+
+    movies["information"] = join_clean(movies["genres"], movies["keywords"], movies["overview"])
+    movies["production"] = join_clean(
+        movies["production_companies"], movies["production_countries"]
     )
-    movies["information"] = movies["information"].apply(clean_text)
 
-    tfidf = TfidfVectorizer(stop_words="english", max_features=5000)
-    matrix = tfidf.fit_transform(movies["information"])
-    similarity = cosine_similarity(matrix)
+    # join_clean already leaves lowercase tokens split by single spaces
+    tfidf = TfidfVectorizer(
+        stop_words="english",
+        max_features=5000,
+        dtype=np.float32,
+        tokenizer=str.split,
+        token_pattern=None,
+        lowercase=False,
+    )
+    # Vectorise each distinct string once, then gather the rows back per movie
+    codes, unique_information = pd.factorize(movies["information"])
+    text_features = tfidf.fit_transform(unique_information)[codes]
+
+    # Stateless hashing: no vocabulary pass over the low-signal production tokens
+    hasher = HashingVectorizer(
+        n_features=PRODUCTION_FEATURES,
+        alternate_sign=False,
+        dtype=np.float32,
+        tokenizer=str.split,
+        token_pattern=None,
+        lowercase=False,
+    )
+    production_features = hasher.transform(movies["production"]) * PRODUCTION_WEIGHT
+    matrix = sparse.hstack([text_features, production_features], format="csr")
+
+    # Cosine similarity of unit rows is their dot product: sparse GEMM per block
+    matrix = normalize(matrix, norm="l2", copy=False)
+    # Serving only ever needs each movie's top neighbours, not the N x N matrix
+    indices, scores = blocked_top_k(matrix, TOP_K)
+    n_items, k = indices.shape
+    neighbors = sparse.csr_matrix(
+        (scores.ravel(), indices.ravel(), np.arange(0, n_items * k + 1, k)),
+        shape=(n_items, n_items),
+    )
 
     MODEL_DIR.mkdir(parents=True, exist_ok=True)
-    movies_out = movies[["id", "title"]].copy()
+    # Plain object titles keep the artifact independent of the Arrow string type
+    movies_out = movies[["id", "title"]].astype({"title": object})
 
     with open(MOVIES_PKL, "wb") as f:
-        pickle.dump(movies_out, f)
-    with open(SIMILARITY_PKL, "wb") as f:
-        pickle.dump(similarity, f)
+        pickle.dump(movies_out, f, protocol=pickle.HIGHEST_PROTOCOL)
+    sparse.save_npz(SIMILARITY_NPZ, neighbors)
 
     print(f"Saved {len(movies_out)} movies to {MOVIES_PKL}")
-    print(f"Saved similarity matrix {similarity.shape} to {SIMILARITY_PKL}")
+    print(f"Saved top-{k} neighbours for {n_items} movies to {SIMILARITY_NPZ}")
 
 
 if __name__ == "__main__":